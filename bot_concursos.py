@@ -1,12 +1,23 @@
 import json
+import mmap
 import os
 import re
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from urllib.parse import urljoin
 
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 URLS = [
     "https://www.pciconcursos.com.br/concursos/sudeste/sp/",
@@ -17,64 +28,131 @@ URLS = [
 ]
 
 DATA_FILE = "concursos.json"
+HTTP_CACHE_FILE = "http_cache.json"
+# Abaixo disso o custo do mmap supera o de copiar o arquivo para a memória.
+MMAP_MIN_SIZE = 64 * 1024
 
 DATE_PATTERN = re.compile(r"\b\d{1,2}[/-]\d{1,2}[/-]\d{4}\b")
+DATE_BYTES_PATTERN = re.compile(rb"\b\d{1,2}[/-]\d{1,2}[/-]\d{4}\b")
 SALARY_PATTERN = re.compile(r"R\$\s*[\d\.]+,\d{2}")
 VACANCY_PATTERN = re.compile(r"(\d+)\s+vagas?", re.IGNORECASE)
 SP_PATTERN = re.compile(r"\bSP\b|São Paulo", re.IGNORECASE)
+URL_PATTERN = re.compile(r"https?://\S+")
+INSCRICOES_PREFIX = "inscrições até"
+INSCRICOES_PATTERN = re.compile(
+    r"Inscrições até\s*(\d{1,2}[/-]\d{1,2}[/-]\d{4})", re.IGNORECASE
+)
+
+# Mesmos trechos que o get_text do BeautifulSoup: sem comentários, scripts e estilos.
+TEXT_NODES = etree.XPath(
+    ".//text()[not(parent::script or parent::style)]", smart_strings=False
+)
+ANCHOR_HREFS = etree.XPath(".//a/@href", smart_strings=False)
+# O html chega decodificado; reencodar em UTF-8 com o encoding fixo no parser
+# evita o ValueError do lxml com declarações <?xml encoding=...?>.
+HTML_PARSER = lxml_html.HTMLParser(encoding="utf-8")
+# Linhas sem link (menus, cabeçalhos) já ficam de fora no próprio XPath.
+LISTING_ROWS = etree.XPath("//ul//li[.//a[@href]] | //table//tr[.//a[@href]]")
 
 BANCAS = [
-    ("Vunesp", re.compile(r"\bVunesp\b", re.IGNORECASE)),
-    ("FGV", re.compile(r"\bFGV\b", re.IGNORECASE)),
-    ("FCC", re.compile(r"\bFCC\b", re.IGNORECASE)),
-    ("Instituto Mais", re.compile(r"Instituto Mais", re.IGNORECASE)),
+    ("Vunesp", r"\bVunesp\b"),
+    ("FGV", r"\bFGV\b"),
+    ("FCC", r"\bFCC\b"),
+    ("Instituto Mais", r"Instituto Mais"),
 ]
+# Um grupo por banca: o rótulo sai do grupo que casou, não do texto casado,
+# que sob IGNORECASE pode vir em grafias como "İnstituto" ou "Vuneſp".
+BANCAS_PATTERN = re.compile(
+    "|".join(f"({pattern})" for _, pattern in BANCAS), re.IGNORECASE
+)
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.DEBUG if os.getenv("DEBUG") else logging.INFO)
 logger = logging.getLogger(__name__)
 
 session = requests.Session()
 session.headers.update({"User-Agent": "Mozilla/5.0"})
+session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    ),
+)
+
+
+def read_json(path: str):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as file:
+            if orjson and os.fstat(file.fileno()).st_size >= MMAP_MIN_SIZE:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    with memoryview(mapped) as view:
+                        return orjson.loads(view)
+            raw = file.read()
+        return orjson.loads(raw) if orjson else json.loads(raw)
+    except ValueError:
+        return None
+
+
+def write_json(path: str, data) -> None:
+    if orjson:
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    else:
+        payload = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+    temp_file = path + ".tmp"
+    with open(temp_file, "wb") as file:
+        file.write(payload)
+    os.replace(temp_file, path)
 
 
 def load_data() -> list:
-    if not os.path.exists(DATA_FILE):
-        return []
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as file:
-            data = json.load(file)
-        return data if isinstance(data, list) else []
-    except json.JSONDecodeError:
-        return []
+    data = read_json(DATA_FILE)
+    return data if isinstance(data, list) else []
 
 
 def save_data(items: list) -> None:
-    temp_file = DATA_FILE + ".tmp"
-    with open(temp_file, "w", encoding="utf-8") as file:
-        json.dump(items, file, ensure_ascii=False, indent=2)
-    os.replace(temp_file, DATA_FILE)
+    write_json(DATA_FILE, items)
+
+
+def load_http_cache() -> dict:
+    data = read_json(HTTP_CACHE_FILE)
+    return data if isinstance(data, dict) else {}
+
+
+def save_http_cache(cache: dict) -> None:
+    write_json(HTTP_CACHE_FILE, cache)
 
 
 def parse_date(text: str):
     date_text = None
 
-    if re.search(r"Inscrições até", text, re.IGNORECASE):
-        match = re.search(r"Inscrições até\s*(\d{1,2}[/-]\d{1,2}[/-]\d{4})", text, re.IGNORECASE)
+    # O str.find só decide se vale rodar o regex; posições de text.lower() não
+    # servem para indexar text, pois lower() pode mudar o tamanho ("İ").
+    if INSCRICOES_PREFIX in text.lower():
+        match = INSCRICOES_PATTERN.search(text)
         if match:
             date_text = match.group(1)
 
     if not date_text:
         match = DATE_PATTERN.search(text)
-        if match:
-            date_text = match.group(0)
+        if not match:
+            return None
+        date_text = match.group(0)
 
-    if not date_text:
-        return None
+    return parse_date_text(date_text)
 
-    date_text = date_text.replace("-", "/")
 
+def parse_date_text(date_text: str):
+    day, month, year = date_text.replace("-", "/").split("/")
     try:
-        return datetime.strptime(date_text, "%d/%m/%Y").date()
+        return date(int(year), int(month), int(day))
     except ValueError:
         return None
 
@@ -103,62 +181,106 @@ def parse_vacancies(text: str):
         return None
 
 
-def find_official_link(container) -> str | None:
-    for anchor in container.find_all("a", href=True):
-        href = anchor["href"]
+def mentions_sp(text: str) -> bool:
+    # Os literais mais comuns resolvem sem regex; o padrão cobre o restante.
+    if "São Paulo" in text or " SP " in text:
+        return True
+    return SP_PATTERN.search(text) is not None
+
+
+def node_text(node) -> str:
+    return " ".join(part for part in (text.strip() for text in TEXT_NODES(node)) if part)
+
+
+def find_official_link(container, text: str) -> str | None:
+    for href in ANCHOR_HREFS(container):
         if "pciconcursos.com.br" in href:
             continue
         if href.startswith("http://") or href.startswith("https://"):
             return href
 
-    urls = re.findall(r"https?://\S+", container.get_text(" ", strip=True))
-    if urls:
-        return urls[0].rstrip(").,;")
+    match = URL_PATTERN.search(text)
+    if match:
+        return match.group(0).rstrip(").,;")
 
     return None
 
 
-def extract_contests(html: str, base_url: str, filter_sp: bool) -> list:
-    soup = BeautifulSoup(html, "html.parser")
-    contests = {}
-    containers = list(soup.select("div.ca"))
+def detect_bancas(text: str) -> tuple:
+    found = {BANCAS[match.lastindex - 1][0] for match in BANCAS_PATTERN.finditer(text)}
+    return tuple(label for label, _ in BANCAS if label in found)
 
-    if not containers:
-        for container in soup.select("ul li, table tr"):
-            anchor = container.find("a", href=True)
-            if not anchor:
-                continue
-            href = anchor.get("href", "")
-            text = anchor.get_text(" ", strip=True)
-            if "concursos" in href or "Concurso" in text:
-                containers.append(container)
 
-    for container in containers:
-        anchor = container.find("a", href=True)
-        if not anchor:
+def extract_contests(html: str, base_url: str, filter_sp: bool, today: date) -> list:
+    try:
+        tree = lxml_html.fromstring(html.encode("utf-8"), parser=HTML_PARSER)
+    except etree.ParserError:
+        # Página sem nenhum elemento (ex.: só um comentário com data).
+        return []
+    contests = {}
+    seen_hrefs = set()
+    # Irmãos compartilham o mesmo pai; o texto dele é serializado uma vez só.
+    parent_texts = {}
+    # (container, âncora, título): a âncora e seu texto são lidos uma única vez.
+    candidates = []
+    # O fallback só entra quando a página não tem nenhum div.ca, mesmo sem link.
+    has_cards = False
+
+    for container in tree.find_class("ca"):
+        if container.tag != "div":
             continue
+        has_cards = True
+        anchor = container.find(".//a[@href]")
+        if anchor is not None:
+            candidates.append((container, anchor, node_text(anchor)))
+
+    if not has_cards:
+        for container in LISTING_ROWS(tree):
+            anchor = container.find(".//a[@href]")
+            if anchor is None:
+                continue
+            href = anchor.get("href")
+            text = node_text(anchor)
+            if "concursos" in href or "Concurso" in text:
+                candidates.append((container, anchor, text))
 
-        title = anchor.get_text(" ", strip=True)
+    for container, anchor, title in candidates:
         if not title or len(title) < 10:
             continue
 
-        text = container.get_text(" ", strip=True)
-        parent_text = container.parent.get_text(" ", strip=True) if container.parent else ""
-
-        sp_match = SP_PATTERN.search(text) or SP_PATTERN.search(parent_text)
-
-        if filter_sp and not sp_match:
+        href = anchor.get("href")
+        if href in seen_hrefs:
             continue
 
+        text = node_text(container)
+
+        # O texto do pai só é serializado quando o do container não basta.
+        if filter_sp and not mentions_sp(text):
+            parent = container.getparent()
+            if parent is None:
+                parent_text = ""
+            elif parent in parent_texts:
+                parent_text = parent_texts[parent]
+            else:
+                parent_text = parent_texts[parent] = node_text(parent)
+            if not mentions_sp(parent_text):
+                continue
+
         end_date = parse_date(text)
         if not end_date:
             continue
 
-        if end_date < date.today():
+        if end_date < today:
+            continue
+
+        seen_hrefs.add(href)
+        link = urljoin(base_url, href)
+        if link in contests:
             continue
 
-        link = urljoin(base_url, anchor["href"])
-        official_link = find_official_link(container)
+        logger.debug("Concurso encontrado: %s (%s)", title, link)
+
+        official_link = find_official_link(container, text)
         vacancies = parse_vacancies(text)
         salary_text, salary_value = parse_salary(text)
 
@@ -170,12 +292,35 @@ def extract_contests(html: str, base_url: str, filter_sp: bool) -> list:
             "vacancies": vacancies,
             "salary_text": salary_text,
             "salary_value": salary_value,
-            "raw_text": text,
+            "bancas": detect_bancas(f"{title} {text}"),
         }
 
     return list(contests.values())
 
 
+def post_webhook(webhook: str, payload: dict) -> None:
+    response = session.post(webhook, json=payload, timeout=(5, 15))
+
+    if response.status_code == 429:
+        time.sleep(parse_seconds(response.headers.get("Retry-After")))
+        response = session.post(webhook, json=payload, timeout=(5, 15))
+
+    if response.status_code >= 400:
+        logger.error(f"Falha ao enviar webhook: {response.status_code} {response.text}")
+        return
+
+    # Esgotou o balde do webhook: espera o reset antes de liberar o worker.
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        time.sleep(parse_seconds(response.headers.get("X-RateLimit-Reset-After")))
+
+
+def parse_seconds(value, default: float = 1.0) -> float:
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
 def send_error_discord(message: str) -> None:
     webhook = os.getenv("DISCORD_WEBHOOK")
     if not webhook:
@@ -191,18 +336,7 @@ def send_error_discord(message: str) -> None:
         ]
     }
 
-    response = session.post(webhook, json=payload, timeout=(5, 15))
-
-    if response.status_code >= 400:
-        logger.error(f"Falha ao enviar webhook: {response.status_code} {response.text}")
-
-
-def detect_bancas(text: str) -> list:
-    matches = []
-    for label, pattern in BANCAS:
-        if pattern.search(text):
-            matches.append(label)
-    return matches
+    post_webhook(webhook, payload)
 
 
 def send_discord(new_items: list) -> None:
@@ -211,16 +345,23 @@ def send_discord(new_items: list) -> None:
         logger.warning("DISCORD_WEBHOOK não configurado.")
         return
 
+    payloads = []
+    footer_text = f"🕒 Atualizado em: {datetime.now():%d/%m/%Y %H:%M}"
+
     for i in range(0, len(new_items), 10):
         chunk = new_items[i : i + 10]
         embeds = []
 
         for item in chunk:
-            end_date = datetime.fromisoformat(item["end_date"]).strftime("%d/%m/%Y")
-            bancas = detect_bancas(f"{item['title']} {item.get('raw_text','')}")
-
+            title = item["title"]
+            iso_date = item["end_date"]
+            vacancies = item.get("vacancies")
             salary_value = item.get("salary_value")
             salary_text = item.get("salary_text")
+            official_link = item.get("official_link")
+
+            end_date = f"{iso_date[8:10]}/{iso_date[5:7]}/{iso_date[0:4]}"
+            bancas = item.get("bancas", ())
 
             # 🔥 REGRA DO /h
             if salary_value is not None and salary_value < 500:
@@ -235,9 +376,9 @@ def send_discord(new_items: list) -> None:
                     {"name": "Banca", "value": f"🎯 {', '.join(bancas)}", "inline": True}
                 )
 
-            if item.get("vacancies"):
+            if vacancies:
                 fields.append(
-                    {"name": "Vagas", "value": str(item["vacancies"]), "inline": True}
+                    {"name": "Vagas", "value": str(vacancies), "inline": True}
                 )
 
             if salary_text:
@@ -245,51 +386,100 @@ def send_discord(new_items: list) -> None:
                     {"name": "Salário", "value": salary_text, "inline": True}
                 )
 
-            if item.get("official_link"):
+            if official_link:
                 fields.append(
-                    {"name": "Link oficial", "value": item["official_link"], "inline": False}
+                    {"name": "Link oficial", "value": official_link, "inline": False}
                 )
 
             embeds.append(
                 {
-                    "title": item["title"],
+                    "title": title,
                     "url": item["link"],
                     "fields": fields,
                     "color": 0xF1C40F if premium else 0x2ECC71,
                     "footer": {
-                        "text": f"🕒 Atualizado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}",
+                        "text": footer_text,
                         "icon_url": "https://cdn-icons-png.flaticon.com/512/2921/2921222.png",
                     },
                 }
             )
 
-        response = session.post(webhook, json={"embeds": embeds}, timeout=(5, 15))
+        payloads.append({"embeds": embeds})
 
-        if response.status_code >= 400:
-            logger.error(f"Falha ao enviar webhook: {response.status_code} {response.text}")
+    # O Discord aceita até 5 requisições a cada 2s por webhook.
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda payload: post_webhook(webhook, payload), payloads))
 
 
-def fetch_page():
-    errors = []
+def probe_url(url: str, validators: dict):
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    try:
+        response = session.get(url, headers=headers, timeout=(5, 15))
+    except requests.RequestException as exc:
+        return None, f"{url} -> {exc}"
+
+    # Só há validadores salvos para fontes que já foram aceitas antes.
+    if response.status_code == 304:
+        return (response.url, None, validators), None
+
+    if response.status_code != 200:
+        return None, f"{url} -> {response.status_code}"
 
-    for url in URLS:
+    # A checagem roda nos bytes; só a fonte aceita é decodificada.
+    content = response.content
+
+    if b"div class=\"ca\"" in content or DATE_BYTES_PATTERN.search(content):
         try:
-            response = session.get(url, timeout=(5, 15))
+            html = content.decode(response.encoding or "utf-8", errors="replace")
+        except LookupError:
+            html = content.decode("utf-8", errors="replace")
+        validators = {}
+        if response.headers.get("ETag"):
+            validators["etag"] = response.headers["ETag"]
+        if response.headers.get("Last-Modified"):
+            validators["last_modified"] = response.headers["Last-Modified"]
+        return (response.url, html, validators), None
 
-            if response.status_code != 200:
-                errors.append(f"{url} -> {response.status_code}")
-                continue
+    return None, f"{url} -> página sem concursos detectáveis"
 
-            html = response.text
 
-            if "div class=\"ca\"" in html or DATE_PATTERN.search(html):
-                logger.info(f"Fonte válida encontrada: {response.url}")
-                return response.url, html
+def use_page(http_cache: dict, url: str, page: tuple):
+    final_url, html, validators = page
+    logger.info(f"Fonte válida encontrada: {final_url}")
+    http_cache.clear()
+    if validators:
+        http_cache[url] = validators
+    return final_url, html
 
-            errors.append(f"{url} -> página sem concursos detectáveis")
 
-        except requests.RequestException as exc:
-            errors.append(f"{url} -> {exc}")
+def fetch_page(http_cache: dict):
+    errors = []
+
+    # A fonte principal vai sempre primeiro; os validadores só valem se foi
+    # ela a aceita na última execução, e aí um 304 encerra a busca.
+    primary = URLS[0]
+    page, error = probe_url(primary, http_cache.get(primary, {}))
+    if page:
+        return use_page(http_cache, primary, page)
+    errors.append(error)
+
+    # As alternativas só são consultadas quando a fonte principal falha. Elas
+    # rodam em paralelo, mas vence a primeira válida na ordem de URLS. Vão sem
+    # validadores: um 304 aqui prenderia o bot a uma fonte de reserva.
+    fallbacks = URLS[1:]
+    with ThreadPoolExecutor(max_workers=len(fallbacks)) as executor:
+        futures = [executor.submit(probe_url, url, {}) for url in fallbacks]
+
+        for url, future in zip(fallbacks, futures):
+            page, error = future.result()
+            if page:
+                return use_page(http_cache, url, page)
+            errors.append(error)
 
     message = "Não foi possível acessar o site do PCI. " + " | ".join(errors)
     send_error_discord(message)
@@ -299,31 +489,35 @@ def fetch_page():
 def main() -> None:
     existing = load_data()
     today = date.today()
+    today_iso = today.isoformat()
 
     cleaned = []
+    existing_links = set()
     for item in existing:
-        end_date = None
+        is_dict = isinstance(item, dict)
 
-        if isinstance(item, dict):
+        if is_dict:
+            # Registros antigos ainda trazem o texto bruto do container.
+            item.pop("raw_text", None)
             end_date_text = item.get("end_date")
-            if end_date_text:
-                try:
-                    end_date = datetime.fromisoformat(end_date_text).date()
-                except ValueError:
-                    end_date = None
-
-        if end_date is None or end_date >= today:
-            cleaned.append(item)
+            # Datas ISO (AAAA-MM-DD) ordenam como texto, sem precisar de parse.
+            if isinstance(end_date_text, str) and end_date_text and end_date_text[:10] < today_iso:
+                continue
 
-    base_url, html = fetch_page()
-    filter_sp = "sudeste" in base_url and "/sp" not in base_url
+        cleaned.append(item)
+        if is_dict and "link" in item:
+            existing_links.add(item["link"])
 
-    scraped = extract_contests(html, base_url, filter_sp)
+    http_cache = load_http_cache()
+    base_url, html = fetch_page(http_cache)
 
-    existing_links = {
-        item["link"] for item in cleaned
-        if isinstance(item, dict) and "link" in item
-    }
+    # 304: a fonte escolhida não mudou desde a última execução.
+    if html is None:
+        logger.info("Página sem alterações desde a última execução.")
+        scraped = []
+    else:
+        filter_sp = "sudeste" in base_url and "/sp" not in base_url
+        scraped = extract_contests(html, base_url, filter_sp, today)
 
     new_items = [item for item in scraped if item["link"] not in existing_links]
 
@@ -346,10 +540,14 @@ def main() -> None:
         if item.get("salary_value") is not None:
             data["salary_value"] = item["salary_value"]
 
+        if item.get("bancas"):
+            data["bancas"] = list(item["bancas"])
+
         return data
 
-    updated = cleaned + [build_persisted_item(item) for item in new_items]
-    save_data(updated)
+    cleaned.extend(build_persisted_item(item) for item in new_items)
+    save_data(cleaned)
+    save_http_cache(http_cache)
 
     if new_items:
         send_discord(new_items)